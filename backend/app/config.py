@@ -1,4 +1,4 @@
-from functools import lru_cache
+from functools import cached_property, lru_cache
 from pathlib import Path
 from typing import Optional
 
@@ -21,15 +21,24 @@ class Settings(BaseSettings):
     jwt_algorithm: str = "HS256"
     access_token_exp_minutes: int = 15
     refresh_token_exp_minutes: int = 60 * 24 * 7  # 1 semaine
-    bcrypt_rounds: int = 12
+    argon2_time_cost: int = 2
+    argon2_memory_cost_kib: int = 64 * 1024
+    argon2_parallelism: int = 1
+    user_cache_ttl_seconds: int = 30
+    # Désactivé par défaut (workers concurrents) : activé en dev via .env, sinon `python -m app.migrations`
+    auto_create_schema: bool = False
 
     model_config = SettingsConfigDict(env_file=PROJECT_ROOT / ".env", env_file_encoding="utf-8")
 
-    @property
+    @cached_property
     def database_url(self) -> str:
         return f"sqlite:///{self.sqlite_db_path}"
 
-    @property
+    @cached_property
+    def async_database_url(self) -> str:
+        return f"sqlite+aiosqlite:///{self.sqlite_db_path}"
+
+    @cached_property
     def cors_allow_origins(self) -> list[str]:
         raw = self.frontend_origin
         return [origin.strip() for origin in raw.split(",") if origin.strip()]
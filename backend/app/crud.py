@@ -1,111 +1,230 @@
-from sqlalchemy import select
-from sqlalchemy.orm import Session
-
-from . import models, schemas
-from .security import hash_password, verify_password
+from datetime import datetime, timedelta, timezone
 
+from sqlalchemy import Row, bindparam, delete, exists, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
 
-def create_user(session: Session, user_in: schemas.UserCreate) -> models.User:
+from . import models, schemas
+from .database import Base
+from .security import (
+    UserSnapshot,
+    cache_user,
+    get_cached_user_by_email,
+    hash_password_async,
+    invalidate_user,
+    password_needs_rehash,
+    verify_password_async,
+)
+
+
+# Messages lus par serialize_pending : chargés dans la même requête (l’utilisateur n’est jamais lu)
+_PENDING_RELATIONS = (
+    joinedload(models.PendingReply.user_message),
+    joinedload(models.PendingReply.bot_message),
+)
+
+# Requêtes des chemins chauds construites une seule fois, paramétrées à l’exécution
+_USER_BY_EMAIL_STMT = select(models.User).where(models.User.email == bindparam("email"))
+
+_EMAIL_EXISTS_STMT = select(exists().where(models.User.email == bindparam("email")))
+
+# Colonnes lues directement : pas d’objets ORM ni d’identity map pour un historique en lecture seule
+_LIST_MESSAGES_STMT = (
+    select(
+        models.Message.id,
+        models.Message.author,
+        models.Message.content,
+        models.Message.direction,
+        models.Message.user_id,
+        models.Message.created_at,
+    )
+    .where(models.Message.user_id == bindparam("user_id"))
+    .order_by(models.Message.created_at.desc(), models.Message.id.desc())
+    .limit(bindparam("limit"))
+)
+
+_CURRENT_PENDING_BY_USER_STMT = (
+    select(models.PendingReply)
+    .options(*_PENDING_RELATIONS)
+    .where(models.PendingReply.user_id == bindparam("user_id"), models.PendingReply.status == "pending")
+    .order_by(models.PendingReply.created_at.desc())
+    .limit(1)
+)
+
+_PENDING_BY_MESSAGE_ID_STMT = (
+    select(models.PendingReply)
+    .options(*_PENDING_RELATIONS)
+    .where(models.PendingReply.user_message_id == bindparam("message_id"))
+)
+
+
+def _save(session: Session, instance: Base, *, commit: bool) -> None:
+    session.add(instance)
+    if commit:
+        session.commit()
+        session.refresh(instance)
+    else:
+        # Laisse l’appelant grouper plusieurs écritures dans une seule transaction
+        session.flush()
+
+
+def _update_pending(session: Session, pending: models.PendingReply, *, commit: bool, **values) -> bool:
+    # UPDATE ... RETURNING : updated_at (onupdate) revient dans la même requête, sans refresh.
+    # Seul un pending encore en attente change d’état : False si un autre traitement l’a devancé.
+    stmt = (
+        update(models.PendingReply.__table__)
+        .where(models.PendingReply.id == pending.id, models.PendingReply.status == "pending")
+        .values(**values)
+        .returning(models.PendingReply.updated_at)
+    )
+    updated_at = session.execute(stmt).scalar_one_or_none()
+    if updated_at is None:
+        return False
+    for key, value in values.items():
+        set_committed_value(pending, key, value)
+    set_committed_value(pending, "updated_at", updated_at)
+    if commit:
+        session.commit()
+    return True
+
+
+# Inscription et connexion passent par une AsyncSession : un verrou SQLite ne bloque pas la boucle d’événements
+async def create_user(session: AsyncSession, user_in: schemas.UserCreate) -> models.User:
     user = models.User(
         email=user_in.email.lower(),
         full_name=user_in.full_name,
-        hashed_password=hash_password(user_in.password),
+        hashed_password=await hash_password_async(user_in.password),
     )
     session.add(user)
-    session.commit()
-    session.refresh(user)
+    await session.commit()
+    await session.refresh(user)
     return user
 
 
-def get_user_by_email(session: Session, email: str) -> models.User | None:
-    stmt = select(models.User).where(models.User.email == email.lower())
-    return session.execute(stmt).scalar_one_or_none()
+async def get_user_by_email(session: AsyncSession, email: str) -> models.User | None:
+    result = await session.execute(_USER_BY_EMAIL_STMT, {"email": email.lower()})
+    return result.scalar_one_or_none()
 
 
-def authenticate_user(session: Session, email: str, password: str) -> models.User | None:
-    user = get_user_by_email(session, email)
-    if not user:
-        return None
-    if not verify_password(password, user.hashed_password):
+async def email_exists(session: AsyncSession, email: str) -> bool:
+    result = await session.execute(_EMAIL_EXISTS_STMT, {"email": email.lower()})
+    return result.scalar()
+
+
+async def authenticate_user(session: AsyncSession, email: str, password: str) -> UserSnapshot | None:
+    user = get_cached_user_by_email(email)
+    if user is None:
+        db_user = await get_user_by_email(session, email)
+        if not db_user:
+            return None
+        user = cache_user(db_user)
+    if not await verify_password_async(password, user.hashed_password):
         return None
+    if password_needs_rehash(user.hashed_password):
+        hashed_password = await hash_password_async(password)
+        await session.execute(
+            update(models.User).where(models.User.id == user.id).values(hashed_password=hashed_password)
+        )
+        await session.commit()
+        invalidate_user(user)
     return user
 
 
-def create_message(session: Session, *, user: models.User, author: str, content: str, direction: str) -> models.Message:
-    message = models.Message(author=author, content=content, direction=direction, user=user)
-    session.add(message)
-    session.commit()
-    session.refresh(message)
+def create_message(
+    session: Session,
+    *,
+    user_id: int,
+    author: str,
+    content: str,
+    direction: models.MessageDirection,
+    commit: bool = True,
+) -> models.Message:
+    message = models.Message(author=author, content=content, direction=direction, user_id=user_id)
+    _save(session, message, commit=commit)
     return message
 
 
-def list_messages(session: Session, user: models.User, limit: int = 50) -> list[models.Message]:
-    stmt = (
-        select(models.Message)
-        .where(models.Message.user_id == user.id)
-        .order_by(models.Message.created_at.desc())
-        .limit(limit)
-    )
-    rows = session.execute(stmt).scalars().all()
-    # Retourner dans l’ordre chronologique
-    return list(reversed(rows))
+def list_messages(session: Session, user: UserSnapshot, limit: int = 50) -> list[Row]:
+    rows = session.execute(_LIST_MESSAGES_STMT, {"user_id": user.id, "limit": limit}).all()
+    # Retourner dans l’ordre chronologique (all() renvoie déjà une liste, inversée sur place)
+    rows.reverse()
+    return rows
 
 
-def delete_message(session: Session, message: models.Message) -> None:
-    session.delete(message)
-    session.commit()
+def get_pending_reply_by_user(session: Session, user: UserSnapshot) -> models.PendingReply | None:
+    return session.execute(_CURRENT_PENDING_BY_USER_STMT, {"user_id": user.id}).scalars().first()
 
 
-def get_pending_reply_by_user(session: Session, user: models.User, *, only_pending: bool = True) -> models.PendingReply | None:
-    stmt = select(models.PendingReply).where(models.PendingReply.user_id == user.id)
-    if only_pending:
-        stmt = stmt.where(models.PendingReply.status == "pending")
-    stmt = stmt.order_by(models.PendingReply.created_at.desc())
-    return session.execute(stmt).scalars().first()
+def purge_stale_pending_replies(session: Session, user: UserSnapshot, *, max_age: timedelta) -> None:
+    """Supprime les pending en erreur ou restés sans réponse plus de `max_age` (sans commit)."""
+    cutoff = datetime.now(timezone.utc) - max_age
+    stmt = delete(models.PendingReply).where(
+        models.PendingReply.user_id == user.id,
+        or_(
+            models.PendingReply.status == "failed",
+            (models.PendingReply.status == "pending") & (models.PendingReply.created_at < cutoff),
+        ),
+    )
+    session.execute(stmt, execution_options={"synchronize_session": False})
+
+
+def has_pending_reply(session: Session, user: UserSnapshot) -> bool:
+    stmt = select(
+        exists().where(models.PendingReply.user_id == user.id, models.PendingReply.status == "pending")
+    )
+    return session.execute(stmt).scalar()
 
 
 def get_pending_reply_by_id(
-    session: Session, pending_id: int, user: models.User | None = None
+    session: Session, pending_id: int, user: UserSnapshot | None = None
 ) -> models.PendingReply | None:
-    stmt = select(models.PendingReply).where(models.PendingReply.id == pending_id)
+    stmt = select(models.PendingReply).options(*_PENDING_RELATIONS).where(models.PendingReply.id == pending_id)
     if user:
         stmt = stmt.where(models.PendingReply.user_id == user.id)
     return session.execute(stmt).scalar_one_or_none()
 
 
-def create_pending_reply(session: Session, user: models.User, user_message: models.Message) -> models.PendingReply:
-    pending = models.PendingReply(user=user, user_message=user_message, status="pending")
-    session.add(pending)
-    session.commit()
-    session.refresh(pending)
+def create_pending_reply(
+    session: Session, user: UserSnapshot, user_message: models.Message, *, commit: bool = True
+) -> models.PendingReply:
+    pending = models.PendingReply(user_id=user.id, user_message=user_message, status="pending")
+    _save(session, pending, commit=commit)
     return pending
 
 
 def complete_pending_reply(
-    session: Session, pending: models.PendingReply, bot_message: models.Message, status: str = "completed"
-) -> models.PendingReply:
-    pending.bot_message_id = bot_message.id
-    pending.status = status
-    session.add(pending)
-    session.commit()
-    session.refresh(pending)
+    session: Session,
+    pending: models.PendingReply,
+    bot_message: models.Message,
+    status: str = "completed",
+    *,
+    commit: bool = True,
+) -> models.PendingReply | None:
+    if not _update_pending(session, pending, commit=commit, bot_message_id=bot_message.id, status=status):
+        return None
+    set_committed_value(pending, "bot_message", bot_message)
     return pending
 
 
-def fail_pending_reply(session: Session, pending: models.PendingReply) -> models.PendingReply:
-    pending.status = "failed"
-    session.add(pending)
-    session.commit()
-    session.refresh(pending)
+def fail_pending_reply(session: Session, pending: models.PendingReply) -> models.PendingReply | None:
+    if not _update_pending(session, pending, commit=True, status="failed"):
+        return None
     return pending
 
 
-def delete_pending_reply(session: Session, pending: models.PendingReply) -> None:
-    session.delete(pending)
-    session.commit()
+async def fail_pending_reply_async(session: AsyncSession, pending_id: int) -> bool:
+    """Passe en `failed` un pending encore en attente, sans lecture préalable (tâche de fond)."""
+    stmt = (
+        update(models.PendingReply.__table__)
+        .where(models.PendingReply.id == pending_id, models.PendingReply.status == "pending")
+        .values(status="failed")
+    )
+    result = await session.execute(stmt)
+    await session.commit()
+    return result.rowcount > 0
 
 
 def get_pending_reply_by_message_id(session: Session, message_id: int) -> models.PendingReply | None:
-    stmt = select(models.PendingReply).where(models.PendingReply.user_message_id == message_id)
-    return session.execute(stmt).scalar_one_or_none()
+    return session.execute(_PENDING_BY_MESSAGE_ID_STMT, {"message_id": message_id}).scalar_one_or_none()
 
@@ -1,16 +1,51 @@
-from sqlalchemy import create_engine
+from collections.abc import AsyncIterator
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import Session, declarative_base, sessionmaker
 
 from .config import settings
 
 
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA busy_timeout=5000",
+)
+
+
 engine = create_engine(
     settings.database_url,
     connect_args={"check_same_thread": False},
+    pool_size=10,
+    max_overflow=10,
     future=True,
 )
 
+# Moteur aiosqlite pour les chemins async (authentification) : pas de thread bloqué pendant la requête
+async_engine = create_async_engine(
+    settings.async_database_url,
+    pool_size=10,
+    max_overflow=10,
+)
+
+
+@event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
+def _apply_sqlite_pragmas(dbapi_connection, _connection_record) -> None:
+    # Exécuté une seule fois par connexion physique : les connexions du pool gardent ces réglages
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, expire_on_commit=False, future=True)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
@@ -22,3 +57,7 @@ def get_session() -> Session:
     finally:
         session.close()
 
+
+async def get_async_session() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal() as session:
+        yield session
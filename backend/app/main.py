@@ -1,9 +1,12 @@
-from datetime import datetime, timedelta, timezone
+import logging
+from contextlib import asynccontextmanager
+from datetime import timedelta
 from typing import Any, Dict
 
-import httpx
-from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, FastAPI, Header, HTTPException, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from . import models, schemas
@@ -14,22 +17,53 @@ from .crud import (
     create_message,
     create_pending_reply,
     create_user,
-    delete_message,
-    delete_pending_reply,
+    email_exists,
     fail_pending_reply,
+    fail_pending_reply_async,
     get_pending_reply_by_id,
     get_pending_reply_by_message_id,
     get_pending_reply_by_user,
-    get_user_by_email,
+    has_pending_reply,
     list_messages,
+    purge_stale_pending_replies,
 )
-from .database import Base, engine, get_session
-from .security import create_access_token, create_refresh_token, decode_token, get_current_user
+from .database import AsyncSessionLocal, async_engine, engine, get_async_session, get_session
+from .migrations import create_schema
+from .security import (
+    UserSnapshot,
+    create_access_token,
+    create_refresh_token,
+    decode_token,
+    get_current_user,
+    load_user,
+)
+
+
+logger = logging.getLogger(__name__)
 
+PENDING_REPLY_TIMEOUT = timedelta(seconds=60)
 
-Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title=settings.app_name)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Import unique et différé : httpx (et h11/httpcore/certifi) n’est chargé qu’au démarrage du serveur
+    import httpx
+
+    if settings.auto_create_schema:
+        create_schema(engine)
+    # Client partagé : les connexions keep-alive vers n8n sont réutilisées d’un envoi à l’autre
+    app.state.n8n_client = httpx.AsyncClient(
+        timeout=settings.request_timeout,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    )
+    try:
+        yield
+    finally:
+        await app.state.n8n_client.aclose()
+        await async_engine.dispose()
+
+
+app = FastAPI(title=settings.app_name, lifespan=lifespan, default_response_class=ORJSONResponse)
 api_router = APIRouter(prefix="/api")
 
 app.add_middleware(
@@ -41,31 +75,36 @@ app.add_middleware(
 )
 
 
-async def forward_to_n8n(payload: Dict[str, Any]) -> Dict[str, Any]:
-    if not settings.n8n_webhook_url:
-        raise HTTPException(status_code=500, detail="La variable N8N_WEBHOOK_URL n’est pas configurée.")
+async def forward_to_n8n(payload: Dict[str, Any]) -> None:
+    response = await app.state.n8n_client.post(settings.n8n_webhook_url, json=payload)
+    # Seul le statut compte : la réponse de n8n arrive par /chat/callback, le corps n’est pas lu
+    response.raise_for_status()
 
-    async with httpx.AsyncClient(timeout=settings.request_timeout) as client:
-        response = await client.post(settings.n8n_webhook_url, json=payload)
 
+async def forward_pending_to_n8n(payload: Dict[str, Any], pending_id: int) -> None:
+    """Tâche de fond : en cas d’échec du webhook, le pending passe en `failed` pour le polling du frontend."""
     try:
-        response.raise_for_status()
-    except httpx.HTTPStatusError as exc:
-        raise HTTPException(status_code=502, detail=f"Erreur du webhook n8n: {exc.response.text}") from exc
+        await forward_to_n8n(payload)
+    except Exception:
+        # Toute erreur (réseau, statut HTTP, URL mal configurée…) : personne d’autre ne la verrait en tâche de fond
+        logger.exception("Échec de l’appel au webhook n8n pour le pending %s", pending_id)
+        # Session async : l’écriture (et une éventuelle attente du verrou SQLite) ne bloque pas la boucle
+        async with AsyncSessionLocal() as session:
+            await fail_pending_reply_async(session, pending_id)
+
 
-    content_type = response.headers.get("content-type", "")
-    if "application/json" in content_type:
-        return response.json()
+_HEALTH_BODY = b'{"status":"ok"}'
 
-    return {"reply": response.text}
 
+async def health(_request: Request) -> Response:
+    # Route Starlette brute : ni résolution de dépendances ni sérialisation pour les sondes
+    return Response(content=_HEALTH_BODY, media_type="application/json")
 
-@api_router.get("/health")
-async def health() -> dict[str, str]:
-    return {"status": "ok"}
 
+app.add_route(f"{api_router.prefix}/health", health, methods=["GET"])
 
-def issue_tokens(user: models.User) -> schemas.TokenPair:
+
+def issue_tokens(user: models.User | UserSnapshot) -> schemas.TokenPair:
     return schemas.TokenPair(
         access_token=create_access_token(user.id),
         refresh_token=create_refresh_token(user.id),
@@ -74,32 +113,38 @@ def issue_tokens(user: models.User) -> schemas.TokenPair:
 
 
 @api_router.post("/auth/register", response_model=schemas.TokenPair, status_code=status.HTTP_201_CREATED)
-def register_user(payload: schemas.UserCreate, session: Session = Depends(get_session)) -> schemas.TokenPair:
-    if get_user_by_email(session, payload.email):
+async def register_user(
+    payload: schemas.UserCreate, session: AsyncSession = Depends(get_async_session)
+) -> schemas.TokenPair:
+    if await email_exists(session, payload.email):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cet email est déjà utilisé.")
-    user = create_user(session, payload)
+    user = await create_user(session, payload)
     return issue_tokens(user)
 
 
 @api_router.post("/auth/login", response_model=schemas.TokenPair)
-def login(payload: schemas.UserLogin, session: Session = Depends(get_session)) -> schemas.TokenPair:
-    user = authenticate_user(session, payload.email, payload.password)
+async def login(
+    payload: schemas.UserLogin, session: AsyncSession = Depends(get_async_session)
+) -> schemas.TokenPair:
+    user = await authenticate_user(session, payload.email, payload.password)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Identifiants invalides.")
     return issue_tokens(user)
 
 
 @api_router.post("/auth/refresh", response_model=schemas.TokenPair)
-def refresh(payload: schemas.RefreshRequest, session: Session = Depends(get_session)) -> schemas.TokenPair:
+async def refresh(
+    payload: schemas.RefreshRequest, session: AsyncSession = Depends(get_async_session)
+) -> schemas.TokenPair:
     token_data = decode_token(payload.refresh_token, expected_type="refresh")
-    user = session.get(models.User, int(token_data["sub"]))
+    user = await load_user(session, int(token_data["sub"]))
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Utilisateur introuvable")
     return issue_tokens(user)
 
 
 @api_router.get("/auth/me", response_model=schemas.UserOut)
-def me(current_user: models.User = Depends(get_current_user)) -> schemas.UserOut:
+def me(current_user: UserSnapshot = Depends(get_current_user)) -> schemas.UserOut:
     return schemas.UserOut.model_validate(current_user)
 
 
@@ -107,75 +152,75 @@ def me(current_user: models.User = Depends(get_current_user)) -> schemas.UserOut
 def get_messages(
     limit: int = 50,
     session: Session = Depends(get_session),
-    current_user: models.User = Depends(get_current_user),
-) -> schemas.HistoryResponse:
-    messages = list_messages(session, user=current_user, limit=limit)
-    return schemas.HistoryResponse(messages=[schemas.MessageOut.model_validate(m) for m in messages])
+    current_user: UserSnapshot = Depends(get_current_user),
+) -> Response:
+    rows = list_messages(session, user=current_user, limit=limit)
+    history = schemas.HistoryResponse(messages=schemas.MESSAGE_LIST_ADAPTER.validate_python(rows, from_attributes=True))
+    # Sérialisé ici : FastAPI renvoie la Response telle quelle, sans revalider ni réencoder l’historique
+    return Response(content=history.model_dump_json(), media_type="application/json")
+
+
+def serialize_message(message: models.Message) -> schemas.MessageOut:
+    # Données issues de colonnes typées en base : pas de revalidation (à ne jamais utiliser sur une saisie utilisateur)
+    return schemas.MessageOut.model_construct(
+        id=message.id,
+        author=message.author,
+        content=message.content,
+        direction=message.direction.value,
+        user_id=message.user_id,
+        created_at=message.created_at,
+    )
 
 
 def serialize_pending(pending: models.PendingReply) -> schemas.PendingStatusResponse:
     return schemas.PendingStatusResponse(
         id=pending.id,
         status=pending.status,
-        user=schemas.MessageOut.model_validate(pending.user_message),
-        bot=schemas.MessageOut.model_validate(pending.bot_message) if pending.bot_message else None,
+        user=serialize_message(pending.user_message),
+        bot=serialize_message(pending.bot_message) if pending.bot_message else None,
     )
 
 
+# Route synchrone : les écritures SQLite (et l’attente éventuelle du verrou) tournent dans le threadpool
 @api_router.post("/chat", response_model=schemas.ChatQueuedResponse, status_code=status.HTTP_201_CREATED)
-async def send_message(
+def send_message(
     payload: schemas.ChatRequest,
+    background_tasks: BackgroundTasks,
     session: Session = Depends(get_session),
-    current_user: models.User = Depends(get_current_user),
+    current_user: UserSnapshot = Depends(get_current_user),
 ) -> schemas.ChatQueuedResponse:
     if payload.user_id != current_user.id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Utilisateur invalide pour ce token.")
+    if not settings.n8n_webhook_url:
+        raise HTTPException(status_code=500, detail="La variable N8N_WEBHOOK_URL n’est pas configurée.")
 
-    existing_pending = get_pending_reply_by_user(session, current_user, only_pending=False)
-    if existing_pending:
-        # Si le pending est en erreur, on le supprime immédiatement pour permettre un nouvel envoi
-        if existing_pending.status == "failed":
-            delete_pending_reply(session, existing_pending)
-        # Si le pending est plus ancien que 60 secondes, on le supprime pour permettre un nouvel envoi
-        else:
-            now = datetime.now(timezone.utc)
-            # S'assurer que created_at est timezone-aware
-            pending_created_at = existing_pending.created_at
-            if pending_created_at.tzinfo is None:
-                pending_created_at = pending_created_at.replace(tzinfo=timezone.utc)
-            pending_age = now - pending_created_at
-            if pending_age > timedelta(seconds=60):
-                delete_pending_reply(session, existing_pending)
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_409_CONFLICT, detail="Une réponse est déjà en attente pour cet utilisateur."
-                )
+    # Les pending en erreur ou expirés ne bloquent pas un nouvel envoi
+    purge_stale_pending_replies(session, current_user, max_age=PENDING_REPLY_TIMEOUT)
+    if has_pending_reply(session, current_user):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail="Une réponse est déjà en attente pour cet utilisateur."
+        )
 
     inbound = create_message(
         session,
-        user=current_user,
+        user_id=current_user.id,
         author=current_user.full_name,
         content=payload.content,
-        direction="user",
+        direction=models.MessageDirection.USER,
+        commit=False,
     )
+    pending = create_pending_reply(session, current_user, inbound, commit=False)
+    # Message entrant et pending écrits dans une seule transaction
+    session.commit()
 
-    pending = create_pending_reply(session, current_user, inbound)
-
-    try:
-        payload_for_n8n = payload.model_dump()
-        payload_for_n8n["message_id"] = inbound.id
-        payload_for_n8n["pending_reply_id"] = pending.id
-        await forward_to_n8n(payload_for_n8n)
-    except (httpx.HTTPError, HTTPException) as exc:
-        # En cas d'erreur, supprimer immédiatement le pending et le message pour permettre un nouvel envoi
-        delete_pending_reply(session, pending)
-        delete_message(session, inbound)
-        if isinstance(exc, HTTPException):
-            raise exc
-        raise HTTPException(status_code=502, detail=str(exc)) from exc
+    payload_for_n8n = payload.model_dump()
+    payload_for_n8n["message_id"] = inbound.id
+    payload_for_n8n["pending_reply_id"] = pending.id
+    # La réponse n8n arrive par /chat/callback : inutile de garder la requête ouverte pendant l’appel
+    background_tasks.add_task(forward_pending_to_n8n, payload_for_n8n, pending.id)
 
     return schemas.ChatQueuedResponse(
-        user=schemas.MessageOut.model_validate(inbound),
+        user=serialize_message(inbound),
         pending_reply_id=pending.id,
     )
 
@@ -184,7 +229,7 @@ async def send_message(
 def get_pending_status(
     pending_id: int,
     session: Session = Depends(get_session),
-    current_user: models.User = Depends(get_current_user),
+    current_user: UserSnapshot = Depends(get_current_user),
 ) -> schemas.PendingStatusResponse:
     pending = get_pending_reply_by_id(session, pending_id, current_user)
     if not pending:
@@ -195,9 +240,9 @@ def get_pending_status(
 @api_router.get("/chat/pending", response_model=schemas.PendingStatusResponse)
 def get_current_pending(
     session: Session = Depends(get_session),
-    current_user: models.User = Depends(get_current_user),
+    current_user: UserSnapshot = Depends(get_current_user),
 ) -> schemas.PendingStatusResponse:
-    pending = get_pending_reply_by_user(session, current_user, only_pending=True)
+    pending = get_pending_reply_by_user(session, current_user)
     if not pending:
         raise HTTPException(status_code=404, detail="Aucune réponse en attente.")
     return serialize_pending(pending)
@@ -207,15 +252,17 @@ def get_current_pending(
 def fail_pending(
     pending_id: int,
     session: Session = Depends(get_session),
-    current_user: models.User = Depends(get_current_user),
+    current_user: UserSnapshot = Depends(get_current_user),
 ) -> schemas.PendingStatusResponse:
     pending = get_pending_reply_by_id(session, pending_id, current_user)
     if not pending:
         raise HTTPException(status_code=404, detail="Réponse en attente introuvable.")
     if pending.status != "pending":
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Ce message a déjà été traité.")
-    pending = fail_pending_reply(session, pending)
-    return serialize_pending(pending)
+    failed = fail_pending_reply(session, pending)
+    if failed is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Ce message a déjà été traité.")
+    return serialize_pending(failed)
 
 
 @api_router.post("/chat/callback", response_model=schemas.PendingStatusResponse)
@@ -235,14 +282,19 @@ def receive_n8n_callback(
 
     bot_message = create_message(
         session,
-        user=pending.user,
+        user_id=pending.user_id,
         author=payload.author or "n8n",
         content=payload.reply,
-        direction="n8n",
+        direction=models.MessageDirection.N8N,
+        commit=False,
     )
 
-    pending = complete_pending_reply(session, pending, bot_message)
-    return serialize_pending(pending)
+    completed = complete_pending_reply(session, pending, bot_message)
+    if completed is None:
+        # Pending passé en `failed` entre-temps : la réponse n8n n’est pas enregistrée
+        session.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Ce message a déjà été traité.")
+    return serialize_pending(completed)
 
 
 app.include_router(api_router)
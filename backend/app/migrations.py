@@ -0,0 +1,64 @@
+from sqlalchemy import Connection, Engine, MetaData
+from sqlalchemy.schema import CreateTable
+
+from . import models
+from .database import Base, engine
+
+
+_MESSAGES_REBUILD = "_messages_rebuild"
+
+# Index mono-colonne retirés du modèle : préfixes gauches des index composites (user_id, …)
+_OBSOLETE_INDEXES = ("ix_messages_user_id", "ix_pending_replies_user_id")
+
+
+def _column_default(connection: Connection, table: str, column: str) -> tuple[bool, str | None]:
+    for row in connection.exec_driver_sql(f"PRAGMA table_info({table})"):
+        if row[1] == column:
+            return True, row[4]
+    return False, None
+
+
+def _rebuild_messages(connection: Connection) -> None:
+    # SQLite ne sait pas ajouter un DEFAULT à une colonne : table recréée, copiée puis renommée
+    table = models.Message.__table__
+    metadata = MetaData()
+    models.User.__table__.to_metadata(metadata)
+    rebuilt = table.to_metadata(metadata, name=_MESSAGES_REBUILD)
+    columns = ", ".join(column.name for column in table.columns)
+
+    connection.exec_driver_sql(f"DROP TABLE IF EXISTS {_MESSAGES_REBUILD}")
+    connection.execute(CreateTable(rebuilt))
+    connection.exec_driver_sql(f"INSERT INTO {_MESSAGES_REBUILD} ({columns}) SELECT {columns} FROM messages")
+    connection.exec_driver_sql("DROP TABLE messages")
+    # Renommer la nouvelle table ne touche pas aux clés étrangères de pending_replies, qui visent déjà `messages`
+    connection.exec_driver_sql(f"ALTER TABLE {_MESSAGES_REBUILD} RENAME TO messages")
+
+
+def _sync_indexes(connection: Connection) -> None:
+    # create_all n’ajoute pas d’index à une table existante : ceux du modèle sont créés s’ils manquent
+    for name in _OBSOLETE_INDEXES:
+        connection.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def upgrade_schema(bind: Engine) -> None:
+    """Applique aux bases existantes les changements que `create_all` ignore (tables déjà créées)."""
+    with bind.begin() as connection:
+        # messages.created_at est rempli par SQLITE_NOW : les tables antérieures n’ont pas ce DEFAULT
+        exists, default = _column_default(connection, "messages", "created_at")
+        if exists and default is None:
+            _rebuild_messages(connection)
+        _sync_indexes(connection)
+
+
+def create_schema(bind: Engine) -> None:
+    """Crée les tables manquantes puis met à niveau les tables existantes."""
+    Base.metadata.create_all(bind=bind)
+    upgrade_schema(bind)
+
+
+if __name__ == "__main__":
+    # Production : à lancer une seule fois avant les workers (`python -m app.migrations` depuis backend/)
+    create_schema(engine)
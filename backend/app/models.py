@@ -1,13 +1,23 @@
 from __future__ import annotations
 
+import enum
 from datetime import datetime
 
-from sqlalchemy import DateTime, ForeignKey, Integer, String
+from sqlalchemy import DateTime, Enum, ForeignKey, Index, Integer, String, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .database import Base
 
 
+# CURRENT_TIMESTAMP de SQLite s’arrête à la seconde : strftime('%f') garde les millisecondes (ordre de l’historique)
+SQLITE_NOW = text("(strftime('%Y-%m-%d %H:%M:%f', 'now'))")
+
+
+class MessageDirection(str, enum.Enum):
+    USER = "user"
+    N8N = "n8n"
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -22,23 +32,34 @@ class User(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    # Historique d’un utilisateur : parcours inverse de l’index, sans tri (le rowid départage les ex aequo)
+    __table_args__ = (Index("ix_messages_user_created", "user_id", "created_at"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     author: Mapped[str] = mapped_column(String(50), nullable=False)
     content: Mapped[str] = mapped_column(String, nullable=False)
-    direction: Mapped[str] = mapped_column(String(20), nullable=False)
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False, index=True)
+    # Valeurs ("user", "n8n") stockées telles quelles : compatibles avec les lignes existantes
+    direction: Mapped[MessageDirection] = mapped_column(
+        Enum(MessageDirection, values_callable=lambda members: [member.value for member in members]),
+        nullable=False,
+    )
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=SQLITE_NOW, nullable=False)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
 
     user: Mapped[User] = relationship("User", back_populates="messages")
 
 
 class PendingReply(Base):
     __tablename__ = "pending_replies"
+    __table_args__ = (
+        # Sert le filtre user_id/status et le tri created_at DESC du dernier pending (parcours inverse)
+        Index("ix_pending_user_status_created", "user_id", "status", "created_at"),
+        Index("ix_pending_user_message_id", "user_message_id", unique=True),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False, index=True)
-    user_message_id: Mapped[int] = mapped_column(ForeignKey("messages.id"), nullable=False, unique=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
+    user_message_id: Mapped[int] = mapped_column(ForeignKey("messages.id"), nullable=False)
     bot_message_id: Mapped[int | None] = mapped_column(ForeignKey("messages.id"), nullable=True)
     status: Mapped[str] = mapped_column(String(20), default="pending", nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
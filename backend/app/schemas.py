@@ -1,7 +1,13 @@
 from datetime import datetime
-from typing import List, Literal, Optional
+from typing import Annotated, List, Literal, Optional
 
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, StringConstraints, TypeAdapter
+
+
+# Bornes vérifiées par pydantic-core avant toute copie côté Python ; l’auteur suit la colonne String(50).
+# Seule la saisie utilisateur est bornée : une réponse n8n refusée serait perdue (colonne content sans limite).
+UserMessageText = Annotated[str, StringConstraints(min_length=1, max_length=8192)]
+AuthorName = Annotated[str, StringConstraints(max_length=50)]
 
 
 class UserBase(BaseModel):
@@ -14,12 +20,11 @@ class UserCreate(UserBase):
 
 
 class UserOut(UserBase):
+    model_config = ConfigDict(from_attributes=True, frozen=True)
+
     id: int
     created_at: datetime
 
-    class Config:
-        from_attributes = True
-
 
 class UserLogin(BaseModel):
     email: EmailStr
@@ -27,6 +32,8 @@ class UserLogin(BaseModel):
 
 
 class TokenPair(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     access_token: str
     refresh_token: str
     token_type: str = "bearer"
@@ -40,28 +47,36 @@ class RefreshRequest(BaseModel):
 class MessageBase(BaseModel):
     author: str
     content: str
-    direction: str
+    direction: Literal["user", "n8n"]
     user_id: int
 
 
+# Modèles de sortie figés : construits une fois puis sérialisés, jamais modifiés
 class MessageOut(MessageBase):
+    model_config = ConfigDict(from_attributes=True, frozen=True)
+
     id: int
     created_at: datetime
 
-    class Config:
-        from_attributes = True
-
 
 class ChatRequest(BaseModel):
-    content: str = Field(..., examples=["Bonjour n8n"])
+    content: UserMessageText = Field(..., examples=["Bonjour n8n"])
     user_id: int
 
 
 class HistoryResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     messages: List[MessageOut]
 
 
+# Valide une liste de messages en un seul appel pydantic-core plutôt qu’un model_validate par ligne
+MESSAGE_LIST_ADAPTER = TypeAdapter(list[MessageOut])
+
+
 class PendingStatusResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     id: int
     status: Literal["pending", "completed", "failed"]
     user: MessageOut
@@ -69,6 +84,8 @@ class PendingStatusResponse(BaseModel):
 
 
 class ChatQueuedResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     user: MessageOut
     pending_reply_id: int
 
@@ -76,5 +93,5 @@ class ChatQueuedResponse(BaseModel):
 class N8nCallbackPayload(BaseModel):
     message_id: int = Field(..., description="Identifiant du message utilisateur d’origine.")
     reply: str = Field(..., description="Texte retourné par n8n.")
-    author: str | None = Field(default="n8n", description="Auteur à afficher pour la réponse.")
+    author: AuthorName | None = Field(default="n8n", description="Auteur à afficher pour la réponse.")
 
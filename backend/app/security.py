@@ -1,42 +1,192 @@
 from __future__ import annotations
 
-from datetime import datetime, timedelta, timezone
+import hashlib
+import hmac
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
 from typing import Any, Dict, Optional
 
+import anyio
 import bcrypt
 import jwt
+import orjson
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from cachetools import TTLCache
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from sqlalchemy.orm import Session
+from jwt.algorithms import HMACAlgorithm
+from jwt.utils import base64url_encode
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from . import models
 from .config import settings
-from .database import get_session
+from .database import get_async_session
 
 
 bearer_scheme = HTTPBearer(auto_error=False)
 
+_password_hasher = PasswordHasher(
+    time_cost=settings.argon2_time_cost,
+    memory_cost=settings.argon2_memory_cost_kib,
+    parallelism=settings.argon2_parallelism,
+)
 
-def hash_password(password: str) -> str:
-    salt = bcrypt.gensalt(rounds=settings.bcrypt_rounds)
-    return bcrypt.hashpw(password.encode("utf-8"), salt).decode("utf-8")
+# Limiteur dédié : Argon2 et bcrypt libèrent le GIL, on les exécute en parallèle sur autant de threads que
+# de cœurs sans consommer les jetons du pool par défaut utilisé par les routes synchrones.
+_password_limiter = anyio.CapacityLimiter(os.cpu_count() or 2)
 
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+@dataclass(frozen=True, slots=True)
+class UserSnapshot:
+    """Copie détachée d’un utilisateur, partageable entre requêtes sans session SQLAlchemy."""
+
+    id: int
+    email: str
+    full_name: str
+    created_at: datetime
+    hashed_password: str = field(repr=False)
+
+    @classmethod
+    def from_model(cls, user: models.User) -> UserSnapshot:
+        return cls(
+            id=user.id,
+            email=user.email,
+            full_name=user.full_name,
+            created_at=user.created_at,
+            hashed_password=user.hashed_password,
+        )
+
+
+# Les dépendances synchrones tournent sur plusieurs threads : TTLCache n’est pas thread-safe
+_user_cache_lock = threading.Lock()
+_users_by_id: TTLCache[int, UserSnapshot] = TTLCache(maxsize=10_000, ttl=settings.user_cache_ttl_seconds)
+_users_by_email: TTLCache[str, UserSnapshot] = TTLCache(maxsize=10_000, ttl=settings.user_cache_ttl_seconds)
+
+
+def cache_user(user: models.User) -> UserSnapshot:
+    snapshot = UserSnapshot.from_model(user)
+    with _user_cache_lock:
+        _users_by_id[snapshot.id] = snapshot
+        _users_by_email[snapshot.email] = snapshot
+    return snapshot
+
+
+def get_cached_user(user_id: int) -> UserSnapshot | None:
+    with _user_cache_lock:
+        return _users_by_id.get(user_id)
+
+
+def get_cached_user_by_email(email: str) -> UserSnapshot | None:
+    with _user_cache_lock:
+        return _users_by_email.get(email.lower())
+
+
+async def load_user(session: AsyncSession, user_id: int) -> UserSnapshot | None:
+    """Utilisateur depuis le cache, sinon depuis la base (puis mis en cache)."""
+    user = get_cached_user(user_id)
+    if user is None:
+        db_user = await session.get(models.User, user_id)
+        if db_user is None:
+            return None
+        user = cache_user(db_user)
+    return user
+
+
+def invalidate_user(user: UserSnapshot) -> None:
+    with _user_cache_lock:
+        _users_by_id.pop(user.id, None)
+        _users_by_email.pop(user.email, None)
+
+
+class _PrekeyedHMACAlgorithm(HMACAlgorithm):
+    """HMAC dont le key schedule est calculé une seule fois : chaque signature part d’une copie."""
+
+    def __init__(self, hash_alg: Any, key: bytes) -> None:
+        super().__init__(hash_alg)
+        self._key = key
+        self._template = hmac.new(key, digestmod=hash_alg)
+
+    def sign(self, msg: bytes, key: bytes) -> bytes:
+        if key != self._key:
+            return super().sign(msg, key)
+        mac = self._template.copy()
+        mac.update(msg)
+        return mac.digest()
+
+    def verify(self, msg: bytes, key: bytes, sig: bytes) -> bool:
+        return hmac.compare_digest(sig, self.sign(msg, key))
+
+
+def _prepare_jwt_key() -> jwt.PyJWK | str:
+    # Avec un PyJWK, PyJWT réutilise la clé et l’algorithme déjà préparés au lieu de refaire prepare_key
+    if settings.jwt_algorithm.startswith("HS"):
+        secret = base64url_encode(settings.jwt_secret_key.encode("utf-8")).decode("ascii")
+        jwk = jwt.PyJWK({"kty": "oct", "k": secret}, algorithm=settings.jwt_algorithm)
+        jwk.Algorithm = _PrekeyedHMACAlgorithm(jwk.Algorithm.hash_alg, jwk.key)
+        return jwk
+    return settings.jwt_secret_key
+
+
+_jwt = jwt.PyJWT()
+_jwt_key = _prepare_jwt_key()
+_jws = jwt.PyJWS()
+if isinstance(_jwt_key, jwt.PyJWK):
+    _jws.unregister_algorithm(settings.jwt_algorithm)
+    _jws.register_algorithm(settings.jwt_algorithm, _jwt_key.Algorithm)
+
+# Tokens déjà vérifiés, indexés par empreinte (jamais le token brut) ; l’expiration réelle reste le claim `exp`
+_token_cache_lock = threading.Lock()
+_verified_tokens: TTLCache[bytes, Dict[str, Any]] = TTLCache(
+    maxsize=10_000, ttl=settings.access_token_exp_minutes * 60
+)
+
+
+def _is_legacy_bcrypt(hashed: str) -> bool:
+    return hashed.startswith("$2")
+
+
+def _hash_password_sync(password: str) -> str:
+    return _password_hasher.hash(password)
+
+
+def _verify_password_sync(password: str, hashed: str) -> bool:
+    if _is_legacy_bcrypt(hashed):
+        return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("ascii"))
+    try:
+        return _password_hasher.verify(hashed, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+
+async def hash_password_async(password: str) -> str:
+    return await anyio.to_thread.run_sync(_hash_password_sync, password, limiter=_password_limiter)
+
+
+async def verify_password_async(password: str, hashed: str) -> bool:
+    return await anyio.to_thread.run_sync(_verify_password_sync, password, hashed, limiter=_password_limiter)
+
+
+def password_needs_rehash(hashed: str) -> bool:
+    # Les anciens hash bcrypt sont migrés vers Argon2id à la connexion suivante
+    return _is_legacy_bcrypt(hashed) or _password_hasher.check_needs_rehash(hashed)
 
 
 def _create_token(*, subject: str, expires_minutes: int, token_type: str, extra: Optional[Dict[str, Any]] = None) -> str:
-    now = datetime.now(timezone.utc)
+    issued_at = int(time.time())
     payload: Dict[str, Any] = {
         "sub": subject,
         "type": token_type,
-        "iat": int(now.timestamp()),
-        "exp": int((now + timedelta(minutes=expires_minutes)).timestamp()),
+        "iat": issued_at,
+        "exp": issued_at + expires_minutes * 60,
     }
     if extra:
         payload.update(extra)
-    return jwt.encode(payload, settings.jwt_secret_key, algorithm=settings.jwt_algorithm)
+    # Payload sérialisé par orjson puis signé directement au niveau JWS
+    return _jws.encode(orjson.dumps(payload), _jwt_key, algorithm=settings.jwt_algorithm)
 
 
 def create_access_token(user_id: int) -> str:
@@ -56,12 +206,29 @@ def create_refresh_token(user_id: int) -> str:
 
 
 def decode_token(token: str, *, expected_type: str) -> Dict[str, Any]:
-    try:
-        payload = jwt.decode(token, settings.jwt_secret_key, algorithms=[settings.jwt_algorithm])
-    except jwt.ExpiredSignatureError as exc:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expiré") from exc
-    except jwt.InvalidTokenError as exc:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token invalide") from exc
+    # Filtre de forme avant tout décodage : un JWS compact commence par un en-tête JSON encodé (`{"` → `eyJ`)
+    if token.count(".") != 2 or not token.startswith("eyJ"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token invalide")
+
+    key = hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+    with _token_cache_lock:
+        payload = _verified_tokens.get(key)
+    if payload is not None and payload["exp"] <= time.time():
+        with _token_cache_lock:
+            _verified_tokens.pop(key, None)
+        payload = None
+
+    if payload is None:
+        try:
+            payload = _jwt.decode(token, _jwt_key, algorithms=[settings.jwt_algorithm])
+        except jwt.ExpiredSignatureError as exc:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expiré") from exc
+        except jwt.InvalidTokenError as exc:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token invalide") from exc
+        # Seuls les tokens valides sont mis en cache
+        if "exp" in payload:
+            with _token_cache_lock:
+                _verified_tokens[key] = payload
 
     if payload.get("type") != expected_type:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Type de token invalide")
@@ -69,17 +236,19 @@ def decode_token(token: str, *, expected_type: str) -> Dict[str, Any]:
     return payload
 
 
-def get_current_user(
+async def get_current_user(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
-    session: Session = Depends(get_session),
-) -> models.User:
+    session: AsyncSession = Depends(get_async_session),
+) -> UserSnapshot:
     if credentials is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentification requise")
 
     payload = decode_token(credentials.credentials, expected_type="access")
     user_id = payload.get("sub")
+    if user_id is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Utilisateur introuvable")
 
-    user = session.get(models.User, int(user_id)) if user_id is not None else None
+    user = await load_user(session, int(user_id))
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Utilisateur introuvable")
 
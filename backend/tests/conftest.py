@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+
+# Base SQLite jetable : définie avant tout import de l’application (settings lus à l’import)
+os.environ["SQLITE_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "test.db")
+os.environ["AUTO_CREATE_SCHEMA"] = "true"
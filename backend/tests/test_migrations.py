@@ -0,0 +1,83 @@
+import sqlite3
+
+from sqlalchemy import create_engine
+
+from app.migrations import upgrade_schema
+
+
+# Table messages telle que créée avant le DEFAULT SQLite de created_at
+_LEGACY_SCHEMA = """
+CREATE TABLE users (id INTEGER NOT NULL PRIMARY KEY, email VARCHAR(255) NOT NULL);
+CREATE TABLE messages (
+    id INTEGER NOT NULL PRIMARY KEY,
+    author VARCHAR(50) NOT NULL,
+    content VARCHAR NOT NULL,
+    direction VARCHAR(20) NOT NULL,
+    created_at DATETIME NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users (id)
+);
+CREATE INDEX ix_messages_user_id ON messages (user_id);
+CREATE TABLE pending_replies (
+    id INTEGER NOT NULL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    user_message_id INTEGER NOT NULL UNIQUE REFERENCES messages (id),
+    bot_message_id INTEGER REFERENCES messages (id),
+    status VARCHAR(20) NOT NULL,
+    created_at DATETIME NOT NULL,
+    updated_at DATETIME NOT NULL
+);
+CREATE INDEX ix_pending_replies_user_id ON pending_replies (user_id);
+"""
+
+
+def _index_names(connection: sqlite3.Connection, table: str) -> set[str]:
+    return {row[1] for row in connection.execute(f"PRAGMA index_list({table})")}
+
+
+def test_upgrade_schema_adds_created_at_default_and_keeps_rows(tmp_path):
+    db_path = tmp_path / "legacy.db"
+    with sqlite3.connect(db_path) as connection:
+        connection.executescript(_LEGACY_SCHEMA)
+        connection.execute("INSERT INTO users (id, email) VALUES (1, 'old@example.com')")
+        connection.execute(
+            "INSERT INTO messages (author, content, direction, created_at, user_id) VALUES (?, ?, ?, ?, ?)",
+            ("Old", "Bonjour", "user", "2024-01-01 10:00:00.123456", 1),
+        )
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    upgrade_schema(engine)
+    # Deuxième passage sans effet : la table porte déjà le DEFAULT
+    upgrade_schema(engine)
+    engine.dispose()
+
+    with sqlite3.connect(db_path) as connection:
+        assert connection.execute("SELECT author, content, created_at FROM messages").fetchall() == [
+            ("Old", "Bonjour", "2024-01-01 10:00:00.123456")
+        ]
+        connection.execute(
+            "INSERT INTO messages (author, content, direction, user_id) VALUES ('n8n', 'Salut', 'n8n', 1)"
+        )
+        assert connection.execute("SELECT created_at FROM messages WHERE id = 2").fetchone()[0] is not None
+        indexes = _index_names(connection, "messages")
+    assert "ix_messages_user_created" in indexes
+
+
+def test_upgrade_schema_creates_model_indexes_and_drops_obsolete_ones(tmp_path):
+    db_path = tmp_path / "legacy.db"
+    with sqlite3.connect(db_path) as connection:
+        connection.executescript(_LEGACY_SCHEMA)
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    upgrade_schema(engine)
+    engine.dispose()
+
+    with sqlite3.connect(db_path) as connection:
+        messages_indexes = _index_names(connection, "messages")
+        pending_indexes = _index_names(connection, "pending_replies")
+        unique_indexes = {row[1] for row in connection.execute("PRAGMA index_list(pending_replies)") if row[2]}
+    assert {"ix_messages_user_created", "ix_messages_id"} <= messages_indexes
+    assert "ix_messages_user_id" not in messages_indexes
+    assert {"ix_pending_user_status_created", "ix_pending_user_message_id", "ix_pending_replies_id"} <= pending_indexes
+    assert "ix_pending_replies_user_id" not in pending_indexes
+    # Le lookup du callback par user_message_id s’appuie sur cet index unique
+    assert "ix_pending_user_message_id" in unique_indexes
@@ -0,0 +1,83 @@
+import sqlite3
+
+import anyio
+import bcrypt
+from argon2 import PasswordHasher
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.main import app
+from app.security import hash_password_async, password_needs_rehash, verify_password_async
+
+
+_DB_PATH = settings.sqlite_db_path
+
+
+def _insert_legacy_user(email: str, password: bytes) -> str:
+    # Compte créé avant Argon2 : hash bcrypt stocké en TEXT, comme dans les bases existantes
+    legacy_hash = bcrypt.hashpw(password, bcrypt.gensalt(rounds=4)).decode("ascii")
+    with sqlite3.connect(_DB_PATH) as connection:
+        connection.execute(
+            "INSERT INTO users (email, full_name, hashed_password, created_at) VALUES (?, ?, ?, ?)",
+            (email, "Legacy", legacy_hash, "2024-01-01 00:00:00.000000"),
+        )
+    return legacy_hash
+
+
+def _stored_hash(email: str) -> tuple[str, str]:
+    with sqlite3.connect(_DB_PATH) as connection:
+        return connection.execute(
+            "SELECT typeof(hashed_password), hashed_password FROM users WHERE email = ?", (email,)
+        ).fetchone()
+
+
+def test_login_migrates_legacy_bcrypt_text_hash_to_argon2id():
+    with TestClient(app) as client:
+        _insert_legacy_user("legacy@example.com", b"password1")
+
+        response = client.post("/api/auth/login", json={"email": "legacy@example.com", "password": "password1"})
+        assert response.status_code == 200, response.text
+
+        stored_type, stored_hash = _stored_hash("legacy@example.com")
+        assert stored_type == "text"
+        assert stored_hash.startswith("$argon2id$")
+
+        # Le nouveau hash Argon2id est accepté à la connexion suivante
+        response = client.post("/api/auth/login", json={"email": "legacy@example.com", "password": "password1"})
+        assert response.status_code == 200, response.text
+
+
+def test_failed_login_keeps_legacy_bcrypt_hash():
+    with TestClient(app) as client:
+        legacy_hash = _insert_legacy_user("legacy-wrong@example.com", b"password1")
+
+        response = client.post("/api/auth/login", json={"email": "legacy-wrong@example.com", "password": "mauvais"})
+        assert response.status_code == 401, response.text
+        assert _stored_hash("legacy-wrong@example.com") == ("text", legacy_hash)
+
+
+def test_register_stores_argon2id_hash():
+    with TestClient(app) as client:
+        response = client.post(
+            "/api/auth/register",
+            json={"email": "new@example.com", "full_name": "New", "password": "password1"},
+        )
+        assert response.status_code == 201, response.text
+
+    stored_type, stored_hash = _stored_hash("new@example.com")
+    assert stored_type == "text"
+    assert stored_hash.startswith("$argon2id$")
+
+
+def test_argon2id_verification_and_rehash_policy():
+    hashed = anyio.run(hash_password_async, "password1")
+
+    assert anyio.run(verify_password_async, "password1", hashed)
+    assert not anyio.run(verify_password_async, "mauvais", hashed)
+    assert not anyio.run(verify_password_async, "password1", "pas-un-hash")
+
+    assert not password_needs_rehash(hashed)
+    assert password_needs_rehash(bcrypt.hashpw(b"password1", bcrypt.gensalt(rounds=4)).decode("ascii"))
+    # Paramètres Argon2 plus faibles que la configuration : rehash à la prochaine connexion
+    weaker = PasswordHasher(time_cost=1, memory_cost=8 * 1024, parallelism=1).hash("password1")
+    assert password_needs_rehash(weaker)
@@ -0,0 +1,94 @@
+import time
+
+import jwt
+import pytest
+from fastapi import HTTPException
+
+from app import security
+from app.config import settings
+from app.security import create_access_token, create_refresh_token, decode_token
+
+
+def _assert_unauthorized(token: str, expected_type: str, detail: str) -> None:
+    with pytest.raises(HTTPException) as exc_info:
+        decode_token(token, expected_type=expected_type)
+    assert exc_info.value.status_code == 401
+    assert exc_info.value.detail == detail
+
+
+def test_access_and_refresh_tokens_round_trip():
+    assert decode_token(create_access_token(42), expected_type="access")["sub"] == "42"
+    assert decode_token(create_refresh_token(42), expected_type="refresh")["sub"] == "42"
+
+
+def test_tokens_interoperate_with_stock_pyjwt():
+    # La clé HMAC pré-calculée doit produire exactement les signatures de PyJWT
+    payload = jwt.decode(create_access_token(7), settings.jwt_secret_key, algorithms=[settings.jwt_algorithm])
+    assert payload["sub"] == "7"
+
+    token = jwt.encode(
+        {"sub": "8", "type": "access", "exp": int(time.time()) + 60},
+        settings.jwt_secret_key,
+        algorithm=settings.jwt_algorithm,
+    )
+    assert decode_token(token, expected_type="access")["sub"] == "8"
+
+
+def test_tampered_signature_is_rejected():
+    header, payload, signature = create_access_token(1).split(".")
+    middle = len(signature) // 2
+    tampered = signature[:middle] + ("A" if signature[middle] != "A" else "B") + signature[middle + 1 :]
+    _assert_unauthorized(f"{header}.{payload}.{tampered}", "access", "Token invalide")
+
+
+def test_token_signed_with_another_secret_is_rejected():
+    token = jwt.encode(
+        {"sub": "1", "type": "access", "exp": int(time.time()) + 60},
+        "un-autre-secret",
+        algorithm=settings.jwt_algorithm,
+    )
+    _assert_unauthorized(token, "access", "Token invalide")
+
+
+def test_token_type_confusion_is_rejected():
+    _assert_unauthorized(create_refresh_token(1), "access", "Type de token invalide")
+    _assert_unauthorized(create_access_token(1), "refresh", "Type de token invalide")
+
+
+def test_cached_token_is_rejected_once_expired():
+    exp = int(time.time()) + 1
+    token = jwt.encode(
+        {"sub": "3", "type": "access", "exp": exp}, settings.jwt_secret_key, algorithm=settings.jwt_algorithm
+    )
+    cached_before = len(security._verified_tokens)
+    assert decode_token(token, expected_type="access")["sub"] == "3"
+    assert len(security._verified_tokens) == cached_before + 1
+
+    # Le cache ne prolonge pas la validité : le claim exp est revérifié à chaque lecture
+    while time.time() < exp + 0.01:
+        time.sleep(0.05)
+    _assert_unauthorized(token, "access", "Token expiré")
+
+
+def test_cached_access_token_cannot_be_used_as_refresh_token():
+    token = create_access_token(5)
+    decode_token(token, expected_type="access")
+    _assert_unauthorized(token, "refresh", "Type de token invalide")
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        "",
+        "garbage",
+        "a.b.c",
+        "eyJ.",
+        "eyJ..",
+        "eyJ.a.b.c",
+        "eyJhbGciOiJIUzI1NiJ9.e30",
+        "eyJhbGciOiJIUzI1NiJ9.!!!.???",
+        "eyJé.à.ü",
+    ],
+)
+def test_malformed_tokens_are_unauthorized(token):
+    _assert_unauthorized(token, "access", "Token invalide")